@@ -1,12 +1,27 @@
 #!/usr/bin/env python3
+import functools
 import os
 import shutil
 import subprocess
 import sys
 import textwrap
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 import argparse
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
+
+
+# Section marker emitted on both stdout (\echo) and stderr (\warn) ahead of
+# each check in a batched psql script, so one session can serve every check.
+# Requires a psql 13+ client: older clients lack \warn, so a failing check is
+# reported with the whole session's stderr instead of just its own section.
+CHECK_MARKER = "__K:{key}__"
+# Echoed after each check with psql's :SQLSTATE ("00000" on success), so
+# pass/fail doesn't depend on the server's lc_messages language (psql 11+).
+STATUS_MARKER = "__S:{key}__"
+SQLSTATE_OK = "00000"
+# Field separator for unaligned (-A) psql output.
+FIELD_SEP = "|"
 
 
 @dataclass
@@ -14,6 +29,8 @@ class CmdResult:
     code: int
     out: str
     err: str
+    # Parsed tuples for batched catalog checks; empty for plain commands.
+    rows: List[List[str]] = field(default_factory=list)
 
 
 @dataclass
@@ -23,15 +40,26 @@ class Recommendation:
     reason: str
 
 
-def run_cmd(cmd: List[str], env: Optional[dict] = None) -> CmdResult:
+def run_cmd(cmd: List[str], env: Optional[dict] = None, stdin_text: Optional[str] = None) -> CmdResult:
+    # Capture raw bytes and decode leniently; tool output isn't guaranteed UTF-8.
     proc = subprocess.run(
         cmd,
+        input=stdin_text.encode() if stdin_text is not None else None,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
-        text=True,
         env=env,
     )
-    return CmdResult(proc.returncode, proc.stdout.strip(), proc.stderr.strip())
+    return CmdResult(
+        proc.returncode,
+        proc.stdout.decode("utf-8", "replace").strip(),
+        proc.stderr.decode("utf-8", "replace").strip(),
+    )
+
+
+def run_cmd_streaming(cmd: List[str], env: Optional[dict] = None) -> int:
+    # Inherit stdio so long build logs stream live instead of piling up in memory.
+    sys.stdout.flush()
+    return subprocess.run(cmd, env=env).returncode
 
 
 def is_tty() -> bool:
@@ -73,12 +101,14 @@ def arrow_menu(title: str, items: List[str]) -> int:
 
     idx = 0
     while True:
-        sys.stdout.write("\x1b[2J\x1b[H")
-        print(title)
+        # Render each frame with a single write so redraws don't flicker.
+        frame = ["\x1b[2J\x1b[H" + title]
         for i, item in enumerate(items):
             prefix = "➤ " if i == idx else "  "
-            print(f"{prefix}{item}")
-        print("\nUse ↑/↓, Enter to select, q to quit.")
+            frame.append(f"{prefix}{item}")
+        frame.append("\nUse ↑/↓, Enter to select, q to quit.\n")
+        sys.stdout.write("\n".join(frame))
+        sys.stdout.flush()
         key = read_key()
         if key in ("\x1b[A", "k"):
             idx = (idx - 1) % len(items)
@@ -97,46 +127,153 @@ def env_default(key: str, default: str) -> str:
     return val
 
 
+@dataclass(frozen=True)
+class DbEnv:
+    host: str
+    port: str
+    name: str
+    user: str
+    password: str
+    bootstrap_user: str
+    bootstrap_password: str
+    bootstrap_explicit: bool
+
+
+def load_db_env() -> DbEnv:
+    user = env_default("CALIBER_DB_USER", "caliber")
+    password = env_default("CALIBER_DB_PASSWORD", "")
+    return DbEnv(
+        host=env_default("CALIBER_DB_HOST", "localhost"),
+        port=env_default("CALIBER_DB_PORT", "5432"),
+        name=env_default("CALIBER_DB_NAME", "caliber"),
+        user=user,
+        password=password,
+        bootstrap_user=env_default("CALIBER_DB_BOOTSTRAP_USER", user),
+        bootstrap_password=env_default("CALIBER_DB_BOOTSTRAP_PASSWORD", password),
+        bootstrap_explicit="CALIBER_DB_BOOTSTRAP_USER" in os.environ
+        or "CALIBER_DB_BOOTSTRAP_PASSWORD" in os.environ,
+    )
+
+
 def is_local_db(host: str) -> bool:
     return host in ("", "localhost", "127.0.0.1", "::1")
 
 
-def psql_cmd(user: str, password: str, host: str, port: str, db: str, sql: str) -> Tuple[List[str], dict]:
+def db_credentials(db_env: DbEnv, bootstrap: bool) -> Tuple[str, str]:
+    if bootstrap:
+        return db_env.bootstrap_user, db_env.bootstrap_password
+    return db_env.user, db_env.password
+
+
+def psql_cmd(db_env: DbEnv, sql: str, bootstrap: bool = False) -> Tuple[List[str], dict]:
+    user, password = db_credentials(db_env, bootstrap)
+    env = os.environ.copy()
+    if password:
+        env["PGPASSWORD"] = password
+    # -w: never prompt for a password. Probes run concurrently and would
+    # otherwise race on the terminal; a missing password fails and is reported.
+    cmd = ["psql", "-w", "-v", "ON_ERROR_STOP=1", "-h", db_env.host, "-p", db_env.port, "-U", user,
+           "-d", db_env.name, "-c", sql]
+    return cmd, env
+
+
+def psql_batch_cmd(db_env: DbEnv, bootstrap: bool = False) -> Tuple[List[str], dict]:
+    user, password = db_credentials(db_env, bootstrap)
     env = os.environ.copy()
     if password:
         env["PGPASSWORD"] = password
-    cmd = ["psql", "-v", "ON_ERROR_STOP=1", "-h", host, "-p", port, "-U", user, "-d", db, "-c", sql]
+    # Keep going past failing statements so one bad check doesn't hide the rest.
+    cmd = ["psql", "-w", "-X", "-A", "-t", "-F", FIELD_SEP, "-v", "ON_ERROR_STOP=0", "-h", db_env.host,
+           "-p", db_env.port, "-U", user, "-d", db_env.name, "-f", "-"]
     return cmd, env
 
 
+def build_check_script(checks: List[Tuple[str, str]]) -> str:
+    lines = []
+    for key, sql in checks:
+        marker = CHECK_MARKER.format(key=key)
+        lines.append(f"\\echo {marker}")
+        lines.append(f"\\warn {marker}")
+        lines.append(sql)
+        lines.append(f"\\echo {STATUS_MARKER.format(key=key)} :SQLSTATE")
+    return "\n".join(lines) + "\n"
+
+
+def split_check_output(text: str, keys: List[str]) -> Tuple[str, Dict[str, str]]:
+    markers = {CHECK_MARKER.format(key=key): key for key in keys}
+    preamble: List[str] = []
+    sections: Dict[str, List[str]] = {}
+    current = preamble
+    for line in text.splitlines():
+        key = markers.get(line.strip())
+        if key is not None:
+            current = sections.setdefault(key, [])
+            continue
+        current.append(line)
+    return "\n".join(preamble).strip(), {k: "\n".join(v).strip() for k, v in sections.items()}
+
+
+def split_check_statuses(text: str, keys: List[str]) -> Tuple[str, Dict[str, str]]:
+    markers = {STATUS_MARKER.format(key=key): key for key in keys}
+    kept: List[str] = []
+    statuses: Dict[str, str] = {}
+    for line in text.splitlines():
+        marker, _, sqlstate = line.strip().partition(" ")
+        key = markers.get(marker)
+        if key is not None:
+            statuses[key] = sqlstate
+            continue
+        kept.append(line)
+    return "\n".join(kept), statuses
+
+
+def run_check_batch(
+    checks: List[Tuple[str, str]], db_env: DbEnv, bootstrap: bool = False
+) -> Dict[str, CmdResult]:
+    cmd, env = psql_batch_cmd(db_env, bootstrap)
+    res = run_cmd(cmd, env, stdin_text=build_check_script(checks))
+    keys = [key for key, _ in checks]
+    out_text, statuses = split_check_statuses(res.out, keys)
+    _, outs = split_check_output(out_text, keys)
+    err_preamble, errs = split_check_output(res.err, keys)
+    results: Dict[str, CmdResult] = {}
+    for key in keys:
+        if key in statuses:
+            code = 0 if statuses[key] == SQLSTATE_OK else 1
+        else:
+            # psql never reached this check (e.g. connection failure).
+            code = res.code or 1
+        err = errs.get(key, err_preamble if code != 0 else "")
+        out = outs.get(key, "")
+        rows = [line.split(FIELD_SEP) for line in out.splitlines() if line] if code == 0 else []
+        results[key] = CmdResult(code, out, err, rows)
+    return results
+
+
+@functools.lru_cache(maxsize=None)
+def which_cached(name: str, path_env: str) -> str:
+    # Keyed on PATH so edits to it still trigger a fresh lookup.
+    return shutil.which(name, path=path_env) or ""
+
+
 def detect_paths() -> dict:
-    cargo = shutil.which("cargo") or ""
-    psql = shutil.which("psql") or ""
-    return {"cargo": cargo, "psql": psql}
+    path_env = os.environ.get("PATH", os.defpath)
+    return {"cargo": which_cached("cargo", path_env), "psql": which_cached("psql", path_env)}
 
 
 def diagnose() -> Tuple[dict, List[str]]:
-    db_host = env_default("CALIBER_DB_HOST", "localhost")
-    db_port = env_default("CALIBER_DB_PORT", "5432")
-    db_name = env_default("CALIBER_DB_NAME", "caliber")
-    db_user = env_default("CALIBER_DB_USER", "caliber")
-    db_pass = env_default("CALIBER_DB_PASSWORD", "")
-    bootstrap_user_env = os.environ.get("CALIBER_DB_BOOTSTRAP_USER")
-    bootstrap_pass_env = os.environ.get("CALIBER_DB_BOOTSTRAP_PASSWORD")
-    bootstrap_user = env_default("CALIBER_DB_BOOTSTRAP_USER", db_user)
-    bootstrap_pass = env_default("CALIBER_DB_BOOTSTRAP_PASSWORD", db_pass)
-    bootstrap_explicit = bootstrap_user_env is not None or bootstrap_pass_env is not None
+    db_env = load_db_env()
 
     paths = detect_paths()
     notes: List[str] = []
     results = {
         "db": {
-            "host": db_host,
-            "port": db_port,
-            "name": db_name,
-            "user": db_user,
-            "bootstrap_user": bootstrap_user,
-            "is_local": is_local_db(db_host),
+            "host": db_env.host,
+            "port": db_env.port,
+            "name": db_env.name,
+            "user": db_env.user,
+            "bootstrap_user": db_env.bootstrap_user,
+            "is_local": is_local_db(db_env.host),
         },
         "paths": paths,
         "checks": {},
@@ -147,55 +284,58 @@ def diagnose() -> Tuple[dict, List[str]]:
         notes.append("psql not found on PATH.")
         return results, notes
 
+    checks = [
+        # Extension version.
+        ("ext_version", "select extname, extversion from pg_extension where extname = 'caliber_pg';"),
+        # Function exists?
+        ("fn_agent_register",
+         "select 1 from pg_proc p join pg_namespace n on n.oid=p.pronamespace "
+         "where n.nspname='public' and p.proname='caliber_agent_register';"),
+        # Table owned by extension?
+        ("table_owner",
+         "select c.relname, e.extname from pg_class c "
+         "left join pg_depend d on d.objid=c.oid and d.deptype='e' "
+         "left join pg_extension e on e.oid=d.refobjid "
+         "where c.relname='caliber_agent';"),
+        # pgvector available?
+        ("pgvector_available",
+         "select 1 from pg_available_extensions where name = 'vector';"),
+    ]
+
+    # Prefer bootstrap only if explicitly set; otherwise use app user.
+    use_bootstrap = db_env.bootstrap_explicit
+    preferred_user, _ = db_credentials(db_env, use_bootstrap)
+    # The app-user connectivity probe and the check batch are independent
+    # sessions; both block in subprocess.run, so overlap them on threads.
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        connect_cmd, connect_env = psql_cmd(db_env, "select 1;")
+        connect_future = pool.submit(run_cmd, connect_cmd, connect_env)
+        batch_future = pool.submit(run_check_batch, checks, db_env, use_bootstrap)
+        connect_res = connect_future.result()
+        batch = batch_future.result()
+
     # Basic connectivity as app user.
-    cmd, env = psql_cmd(db_user, db_pass, db_host, db_port, db_name, "select 1;")
-    res = run_cmd(cmd, env)
-    results["checks"]["db_user_connect"] = res
-    if res.code != 0:
+    results["checks"]["db_user_connect"] = connect_res
+    if connect_res.code != 0:
         notes.append("DB user connection failed.")
 
-    bootstrap_note_added = False
-
-    def run_check(key: str, sql: str) -> None:
-        nonlocal bootstrap_note_added
-        # Prefer bootstrap only if explicitly set; otherwise use app user.
-        preferred_user = bootstrap_user if bootstrap_explicit else db_user
-        preferred_pass = bootstrap_pass if bootstrap_explicit else db_pass
-        cmd, env = psql_cmd(preferred_user, preferred_pass, db_host, db_port, db_name, sql)
-        res = run_cmd(cmd, env)
-        if res.code != 0 and bootstrap_explicit and preferred_user != db_user:
-            # Fall back to app user for read-only checks.
-            cmd, env = psql_cmd(db_user, db_pass, db_host, db_port, db_name, sql)
-            res_fallback = run_cmd(cmd, env)
-            if res_fallback.code == 0:
-                # Avoid repeating the same note for every check.
-                if not bootstrap_note_added:
-                    notes.append("Bootstrap auth failed; used app user for read-only checks.")
-                    bootstrap_note_added = True
-                results["checks"][key] = res_fallback
-                results["check_users"][key] = db_user
-                return
-        results["checks"][key] = res
+    for key, check_res in batch.items():
+        results["checks"][key] = check_res
         results["check_users"][key] = preferred_user
 
-    # Extension version.
-    run_check("ext_version", "select extname, extversion from pg_extension where extname = 'caliber_pg';")
-
-    # Function exists?
-    run_check("fn_agent_register",
-              "select 1 from pg_proc p join pg_namespace n on n.oid=p.pronamespace "
-              "where n.nspname='public' and p.proname='caliber_agent_register';")
-
-    # Table owned by extension?
-    run_check("table_owner",
-              "select c.relname, e.extname from pg_class c "
-              "left join pg_depend d on d.objid=c.oid and d.deptype='e' "
-              "left join pg_extension e on e.oid=d.refobjid "
-              "where c.relname='caliber_agent';")
-
-    # pgvector available?
-    run_check("pgvector_available",
-              "select 1 from pg_available_extensions where name = 'vector';")
+    failed = [key for key, check_res in batch.items() if check_res.code != 0]
+    if failed and use_bootstrap and preferred_user != db_env.user:
+        # Fall back to app user for read-only checks, re-running only the failures.
+        retry = [(key, sql) for key, sql in checks if key in failed]
+        fallback = run_check_batch(retry, db_env)
+        used_fallback = False
+        for key, check_res in fallback.items():
+            if check_res.code == 0:
+                results["checks"][key] = check_res
+                results["check_users"][key] = db_env.user
+                used_fallback = True
+        if used_fallback:
+            notes.append("Bootstrap auth failed; used app user for read-only checks.")
 
     return results, notes
 
@@ -247,8 +387,8 @@ def build_recommendations(state: dict, notes: List[str]) -> List[Recommendation]
                 )
             )
 
-    fn_ok = "fn_agent_register" in checks and "1" in checks["fn_agent_register"].out
-    ext_ok = "ext_version" in checks and "caliber_pg" in checks["ext_version"].out
+    fn_ok = "fn_agent_register" in checks and bool(checks["fn_agent_register"].rows)
+    ext_ok = "ext_version" in checks and any(row[0] == "caliber_pg" for row in checks["ext_version"].rows)
     if ext_ok and not fn_ok:
         recs.append(
             Recommendation(
@@ -298,7 +438,7 @@ def format_summary(state: dict, notes: List[str]) -> str:
         suffix = f" (as {check_users.get('ext_version', 'unknown')})"
         lines.append("extension: " + (checks["ext_version"].out or checks["ext_version"].err or "no result") + suffix)
     if "fn_agent_register" in checks:
-        fn = "present" if "1" in checks["fn_agent_register"].out else "missing"
+        fn = "present" if checks["fn_agent_register"].rows else "missing"
         suffix = f" (as {check_users.get('fn_agent_register', 'unknown')})"
         lines.append("caliber_agent_register: " + fn + suffix)
     if "table_owner" in checks:
@@ -306,12 +446,23 @@ def format_summary(state: dict, notes: List[str]) -> str:
         lines.append("caliber_agent owner: " + (checks["table_owner"].out or "n/a") + suffix)
     if "pgvector_available" in checks:
         suffix = f" (as {check_users.get('pgvector_available', 'unknown')})"
-        lines.append("pgvector available: " + ("yes" if "1" in checks["pgvector_available"].out else "no") + suffix)
+        lines.append("pgvector available: " + ("yes" if checks["pgvector_available"].rows else "no") + suffix)
     if notes:
         lines.append("notes: " + "; ".join(notes))
     return "\n".join(lines)
 
 
+def format_recommendations(recs: List[Recommendation]) -> str:
+    if not recs:
+        return "No immediate issues detected."
+    lines = ["Recommended actions:"]
+    for i, rec in enumerate(recs, start=1):
+        lines.append(f"{i}. {rec.title}")
+        lines.append(f"   Reason: {rec.reason}")
+        lines.extend(f"   - {cmd}" for cmd in rec.commands)
+    return "\n".join(lines)
+
+
 def format_llm_paste(state: dict, notes: List[str]) -> str:
     checks = state["checks"]
     def block(name: str, res: CmdResult) -> str:
@@ -339,22 +490,12 @@ def main() -> int:
     state, notes = diagnose()
     recs = build_recommendations(state, notes)
 
-    summary = format_summary(state, notes)
-    print(summary)
-    print()
-    if recs:
-        print("Recommended actions:")
-        for i, rec in enumerate(recs, start=1):
-            print(f"{i}. {rec.title}")
-            print(f"   Reason: {rec.reason}")
-            for cmd in rec.commands:
-                print(f"   - {cmd}")
-    else:
-        print("No immediate issues detected.")
+    report = [format_summary(state, notes), "", format_recommendations(recs)]
+    if args.llm:
+        report.extend(["", format_llm_paste(state, notes)])
+    print("\n".join(report))
 
     if args.llm:
-        print()
-        print(format_llm_paste(state, notes))
         return 0
 
     if args.no_menu:
@@ -369,12 +510,10 @@ def main() -> int:
     choice = arrow_menu("Caliber Doctor", menu)
 
     if choice == 0:
-        print()
+        blocks = [""]
         for rec in recs:
-            print(f"{rec.title}")
-            for cmd in rec.commands:
-                print(cmd)
-            print()
+            blocks.append("\n".join([rec.title, *rec.commands, ""]))
+        print("\n".join(blocks))
         return 0
 
     if choice == 1:
@@ -394,11 +533,7 @@ def main() -> int:
             return 0
         cmd = all_cmds[cmd_idx]
         print(f"\nRunning: {cmd}\n")
-        res = run_cmd(["bash", "-lc", cmd], env=os.environ.copy())
-        print(res.out)
-        if res.err:
-            print(res.err, file=sys.stderr)
-        return res.code
+        return run_cmd_streaming(["bash", "-lc", cmd], env=os.environ.copy())
 
     return 0
 
@@ -6,11 +6,13 @@ from pathlib import Path
 def parse_lcov(path: Path) -> float:
     total_lines = 0
     hit_lines = 0
-    for line in path.read_text().splitlines():
-        if line.startswith("LF:"):
-            total_lines += int(line.split(":", 1)[1])
-        elif line.startswith("LH:"):
-            hit_lines += int(line.split(":", 1)[1])
+    # Stream the report; workspace-wide lcov files can run to hundreds of MB.
+    with path.open() as f:
+        for line in f:
+            if line.startswith("LF:"):
+                total_lines += int(line[3:])
+            elif line.startswith("LH:"):
+                hit_lines += int(line[3:])
     if total_lines == 0:
         return 0.0
     return (hit_lines / total_lines) * 100.0